@@ -17,12 +17,20 @@ import unicodedata
 from io import BytesIO
 import numpy as np
 from datetime import datetime, timedelta
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.responses import FileResponse
 import tempfile
 import os
 import base64
+import asyncio
+import multiprocessing
+import re
+import signal
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
 
 OPINION_CATEGORIES = ["Artigo de Opinião", "Comentário"]
 IGNORE_CATEGORIES = ["Desporto"]
@@ -36,41 +44,314 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ICON_PATH = os.path.join(BASE_DIR, "static", "u4.png")
 IMAGE_PATH = os.path.join(BASE_DIR, "static", "u23.png")
 
+# ===== Limites de admissão (configuráveis por variáveis de ambiente) =====
+MAX_UPLOAD_BYTES = int(os.environ.get("REPORT_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_ROWS = int(os.environ.get("REPORT_MAX_ROWS", 20000))
+MAX_CONCURRENT_RENDERS = int(os.environ.get("REPORT_MAX_CONCURRENT_RENDERS", 2))
+MAX_QUEUED_RENDERS = int(os.environ.get("REPORT_MAX_QUEUED_RENDERS", 4))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("REPORT_QUEUE_TIMEOUT_SECONDS", 30))
+RENDER_TIMEOUT_SECONDS = float(os.environ.get("REPORT_RENDER_TIMEOUT_SECONDS", 120))
+RETRY_AFTER_SECONDS = int(os.environ.get("REPORT_RETRY_AFTER_SECONDS", 10))
+MAX_PARTITIONS = int(os.environ.get("REPORT_MAX_PARTITIONS", 50))
+# Workers do pool num pedido /generate-reports. O pedido reserva uma vaga de
+# MAX_CONCURRENT_RENDERS por worker (nunca mais do que MAX_CONCURRENT_RENDERS),
+# de modo que cada worker do uvicorn tem no máximo MAX_CONCURRENT_RENDERS
+# processos a gerar slides ao mesmo tempo, seja qual for o endpoint.
+# Limitações conhecidas:
+# - as vagas são reservadas antes de o Excel ser lido; um ficheiro com menos
+#   partições do que workers usa menos processos mas mantém todas as vagas;
+# - com pool, o processo de render que leu o Excel fica parado como pai do
+#   pool: não gera slides (não ocupa vaga), mas guarda os imports e a sua
+#   cópia do DataFrame, por isso um pedido tem até PARTITION_WORKERS + 1
+#   processos vivos. Com uma só partição (ou um só worker) não há pool e
+#   a render corre nesse mesmo processo.
+# Com `uvicorn --workers N` todos estes limites multiplicam por N.
+PARTITION_WORKERS = int(os.environ.get("REPORT_PARTITION_WORKERS", 2))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+ADMISSION_PATHS = {"/generate-report", "/generate-reports"}
+
+# As renders nunca usam fork: o worker do uvicorn tem threads (to_thread, anyio)
+# e um socket em escuta que o processo filho não deve herdar.
+_RENDER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+if _RENDER_CONTEXT.get_start_method() == "forkserver":
+    # O forkserver importa este módulo (pandas, matplotlib, pptx...) uma única
+    # vez; cada render é um fork já "quente" em vez de repetir os imports.
+    _RENDER_CONTEXT.set_forkserver_preload([__name__])
+
+# Estado partilhado pelo event loop do worker
+_render_slots = asyncio.Semaphore(MAX_CONCURRENT_RENDERS)
+# Serializa quem precisa de várias vagas, para dois pedidos não ficarem
+# cada um com metade das vagas à espera do resto
+_multi_slot_lock = asyncio.Lock()
+_pending_requests = 0
+
+
+class RowLimitExceeded(ValueError):
+    """O Excel tem mais linhas do que MAX_ROWS."""
+
+    def __init__(self, rows, max_rows):
+        super().__init__(f"O ficheiro tem {rows} linhas (máximo permitido: {max_rows}).")
+        self.rows = rows
+        self.max_rows = max_rows
+
+
+class InvalidPartition(ValueError):
+    """Parâmetros de partição inválidos para o ficheiro recebido."""
+
+
+def _too_busy(detail="Servidor ocupado, tente novamente mais tarde."):
+    return HTTPException(status_code=429, detail=detail,
+                         headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def _too_large():
+    return HTTPException(status_code=413,
+                         detail=f"Ficheiro excede o limite de {MAX_UPLOAD_BYTES} bytes.")
+
+
+class AdmissionMiddleware:
+    """Rejeita pedidos a mais (429) ou demasiado grandes (413) antes de ler o upload.
+
+    O limite de bytes é aplicado à medida que o corpo chega, por isso um upload
+    gigante é cortado sem nunca ser guardado por inteiro.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _pending_requests
+        if scope["type"] != "http" or scope["path"] not in ADMISSION_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > MAX_UPLOAD_BYTES:
+            error = _too_large()
+            await JSONResponse(status_code=error.status_code,
+                               content={"detail": error.detail})(scope, receive, send)
+            return
+
+        # A render em curso + a fila de espera estão cheias
+        if _pending_requests >= MAX_CONCURRENT_RENDERS + MAX_QUEUED_RENDERS:
+            error = _too_busy()
+            await JSONResponse(status_code=error.status_code, content={"detail": error.detail},
+                               headers=error.headers)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_UPLOAD_BYTES:
+                    raise _too_large()
+            return message
+
+        _pending_requests += 1
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            _pending_requests -= 1
+
+
 app= FastAPI()
+app.add_middleware(AdmissionMiddleware)
 
-@app.post("/generate-report")
-async def generate_report(file: UploadFile = File(...)):
+
+def _render_worker(conn, target, args):
+    """Corre `target(*args)` num processo à parte e devolve o resultado pelo pipe."""
+    # Grupo de processos próprio, para que um timeout mate também os sub-processos
+    if hasattr(os, "setpgid"):
+        os.setpgid(0, 0)
+    try:
+        target(*args)
+        conn.send(("ok", None))
+    except RowLimitExceeded as e:
+        conn.send(("rows", str(e)))
+    except InvalidPartition as e:
+        conn.send(("invalid", str(e)))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+def _kill_render(proc):
+    """Mata o processo de render e todo o seu grupo (workers do pool incluídos).
+
+    Chamado sempre no fim, mesmo que o processo já tenha morrido (p.ex. OOM):
+    os workers do pool continuariam vivos, órfãos, com a sua cópia dos dados.
+    """
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # O grupo ainda não existe (antes do setpgid) ou já não tem processos
+            pass
+    # O forkserver recolhe o filho assim que termina, por isso o pid pode já ter
+    # sido reutilizado; exitcode consulta o sentinel e só matamos se ainda corre.
+    if proc.exitcode is None:
+        proc.kill()
+
+
+async def run_render(target, *args):
+    """Corre `target(*args)` num processo filho, matando-o se passar RENDER_TIMEOUT_SECONDS.
+
+    Um processo (e não uma thread) é o que permite cancelar a render e
+    devolver a memória ao sistema.
+    """
+    recv_conn, send_conn = _RENDER_CONTEXT.Pipe(duplex=False)
+    proc = _RENDER_CONTEXT.Process(target=_render_worker, args=(send_conn, target, args))
+    proc.start()
+    send_conn.close()
+    poll = asyncio.ensure_future(asyncio.to_thread(recv_conn.poll, RENDER_TIMEOUT_SECONDS))
+    try:
+        # shield: se o pedido for cancelado, a thread continua a usar o pipe
+        ready = await asyncio.shield(poll)
+        if not ready:
+            raise HTTPException(status_code=504,
+                                detail=f"A geração do relatório excedeu {RENDER_TIMEOUT_SECONDS:g}s.")
+        try:
+            status, detail = recv_conn.recv()
+        except EOFError:
+            # O processo morreu sem responder (p.ex. OOM)
+            raise HTTPException(status_code=500,
+                                detail="O processo de geração terminou inesperadamente.")
+    finally:
+        # Sempre, mesmo que o processo já tenha terminado: workers do pool órfãos
+        # mantêm o grupo vivo (e o seu id reservado) até serem mortos aqui
+        _kill_render(proc)
+        # Só fechar o pipe depois de a thread do poll terminar (a morte do
+        # processo filho faz o poll voltar de imediato)
+        poll.add_done_callback(lambda _: recv_conn.close())
+        await asyncio.to_thread(proc.join)
+
+    if status == "rows":
+        raise HTTPException(status_code=413, detail=detail)
+    if status == "invalid":
+        raise HTTPException(status_code=400, detail=detail)
+    if status == "error":
+        raise HTTPException(status_code=500, detail=detail)
+
+
+async def _acquire_render_slots(slots):
+    """Espera por `slots` vagas de render, ou 429 ao fim de QUEUE_TIMEOUT_SECONDS."""
+    acquired = 0
+
+    async def take():
+        nonlocal acquired
+        if slots == 1:
+            await _render_slots.acquire()
+            acquired = 1
+            return
+        async with _multi_slot_lock:
+            while acquired < slots:
+                await _render_slots.acquire()
+                acquired += 1
+
+    try:
+        await asyncio.wait_for(take(), timeout=QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        _release_render_slots(acquired)
+        raise _too_busy("Tempo de espera na fila esgotado, tente novamente mais tarde.")
+    except BaseException:
+        # Cancelamento (p.ex. shutdown): devolver as vagas já reservadas
+        _release_render_slots(acquired)
+        raise
+
+
+def _release_render_slots(slots):
+    for _ in range(slots):
+        _render_slots.release()
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _read_base64(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+async def _handle_upload(file, suffix, target, *args, slots=1):
+    """Guarda o upload, espera por `slots` vagas e corre `target(input, output, *args)`.
+
+    Devolve o caminho do ficheiro gerado; quem chama fica responsável por apagá-lo.
+    """
+    tmp_in_path = tmp_out_path = None
+    done = False
     try:
-        # Guardar Excel temporariamente
+        # Guardar Excel temporariamente, por blocos
         with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_in:
-            content = await file.read()
-            tmp_in.write(content)
             tmp_in_path = tmp_in.name
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                tmp_in.write(chunk)
 
-        # Criar ficheiro temporário para o PPTX
-        tmp_out = tempfile.NamedTemporaryFile(delete=False, suffix=".pptx")
+        # Criar ficheiro temporário para o resultado
+        tmp_out = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
         tmp_out_path = tmp_out.name
         tmp_out.close()
 
-        # Usar a tua função principal
-        main(tmp_in_path, tmp_out_path)
-
-        # Ler o PPTX gerado em bytes
-        with open(tmp_out_path, "rb") as f:
-            pptx_bytes = f.read()
-
-        # Converter para Base64
-        pptx_b64 = base64.b64encode(pptx_bytes).decode("utf-8")
-
-        # Apagar ficheiros temporários
-        os.remove(tmp_in_path)
-        os.remove(tmp_out_path)
+        # Esperar por vaga de render (fila limitada pelo middleware)
+        await _acquire_render_slots(slots)
+        try:
+            await run_render(target, tmp_in_path, tmp_out_path, *args)
+        finally:
+            _release_render_slots(slots)
 
-        # Retornar como JSON
-        return JSONResponse(content={"file_base64": pptx_b64})
+        done = True
+        return tmp_out_path
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Apagar ficheiros temporários (o resultado só em caso de erro)
+        _remove_file(tmp_in_path)
+        if not done:
+            _remove_file(tmp_out_path)
+
+
+@app.post("/generate-report")
+async def generate_report(file: UploadFile = File(...)):
+    tmp_out_path = await _handle_upload(file, ".pptx", main, MAX_ROWS)
+    try:
+        # Ler e converter para Base64 fora do event loop
+        pptx_b64 = await asyncio.to_thread(_read_base64, tmp_out_path)
+    finally:
+        _remove_file(tmp_out_path)
+
+    # Retornar como JSON
+    return JSONResponse(content={"file_base64": pptx_b64})
+
+
+@app.post("/generate-reports")
+async def generate_reports(file: UploadFile = File(...),
+                           partition_column: str = Query(None),
+                           window_days: int = Query(None, gt=0)):
+    """Gera um PPTX por partição (coluna e/ou janela de datas) e devolve-os num zip."""
+    if not partition_column and not window_days:
+        raise HTTPException(status_code=400,
+                            detail="Indique partition_column e/ou window_days.")
+    workers = max(1, min(PARTITION_WORKERS, MAX_CONCURRENT_RENDERS))
+    tmp_out_path = await _handle_upload(file, ".zip", main_multi,
+                                        partition_column, window_days, MAX_ROWS, workers,
+                                        slots=workers)
+
+    # Enviar o zip diretamente do disco e apagá-lo depois da resposta
+    return FileResponse(tmp_out_path, media_type="application/zip",
+                        filename="relatorios.zip",
+                        background=BackgroundTask(_remove_file, tmp_out_path))
 
 @app.get("/ping")
 async def ping():
@@ -143,15 +424,21 @@ def set_slide_background(slide, rgb_color):
     fill.solid()
     fill.fore_color.rgb = RGBColor(*rgb_color)
 
+@lru_cache(maxsize=None)
+def load_asset(path):
+    """Lê uma imagem estática uma única vez por processo."""
+    with open(path, "rb") as f:
+        return f.read()
+
 def add_icon_to_slide(slide, icon_path):
-    slide.shapes.add_picture(icon_path, Inches(0.2), Inches(0.2), height=Inches(0.9))
+    slide.shapes.add_picture(BytesIO(load_asset(icon_path)), Inches(0.2), Inches(0.2), height=Inches(0.9))
 
 def add_image_to_slide(slide, image_path):
     left = Inches(-0.69)
     top = Inches(1.52)
     width = Inches(10.69)
     height = Inches(5.98)
-    slide.shapes.add_picture(image_path, left, top, width=width, height=height)
+    slide.shapes.add_picture(BytesIO(load_asset(image_path)), left, top, width=width, height=height)
 
 from pptx.util import Pt
 
@@ -546,7 +833,8 @@ def _render_table_slide(prs, category_name, rows, base_cols):
             cell.text_frame.paragraphs[0].font.size = Pt(10)
 
 
-def add_cover_slide(prs, title, icon_path, image_path):
+def add_cover_slide(prs, title, icon_path, image_path, period=None):
+    """`period` é um par (início, fim); por omissão usa os últimos 7 dias."""
     slide = prs.slides.add_slide(prs.slide_layouts[5])
     set_slide_background(slide, (64, 64, 64))
     add_icon_to_slide(slide, icon_path)
@@ -565,17 +853,17 @@ def add_cover_slide(prs, title, icon_path, image_path):
     title_shape.height = Inches(1.5)
     
     # ===== Adicionar caixa de texto com intervalo de datas =====
-    from datetime import datetime, timedelta
-
-    hoje = datetime.today()
-    sete_dias_antes = hoje - timedelta(days=7)
+    if period is None:
+        hoje = datetime.today()
+        period = (hoje - timedelta(days=7), hoje)
+    inicio, fim = period
 
     # Formatar no estilo: 31 de julho – 1 de agosto
     meses = ["janeiro", "fevereiro", "março", "abril", "maio", "junho",
              "julho", "agosto", "setembro", "outubro", "novembro", "dezembro"]
 
-    inicio_str = f"{sete_dias_antes.day} de {meses[sete_dias_antes.month-1]}"
-    fim_str = f"{hoje.day} de {meses[hoje.month-1]}"
+    inicio_str = f"{inicio.day} de {meses[inicio.month-1]}"
+    fim_str = f"{fim.day} de {meses[fim.month-1]}"
 
     date_box = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(0.5))
     tf = date_box.text_frame
@@ -607,8 +895,11 @@ def add_closing_slide(prs, icon_path, image_path):
     p.alignment = PP_ALIGN.CENTER
     return slide
 
-def main(input_path, output_path):
+def load_report_data(input_path, max_rows=None):
+    """Lê o Excel e prepara as colunas usadas pelos slides."""
     df = read_excel(input_path)
+    if max_rows is not None and len(df) > max_rows:
+        raise RowLimitExceeded(len(df), max_rows)
     expected_cols = ['Meio','Data de publicação','Título','Publicação','Circulação',
                      'Tema Principal','Tema Secundário','Autor','Instituição','AAV']
     for c in expected_cols:
@@ -625,7 +916,11 @@ def main(input_path, output_path):
         df.loc[~df['Tema Principal'].isin(OPINION_CATEGORIES), 'Tema Principal']
 
     df = df[~df['Categoria_final'].isin(IGNORE_CATEGORIES)]
+    return df
 
+
+def build_report(df, output, period=None):
+    """Gera o PPTX para `df` e grava-o em `output` (caminho ou ficheiro)."""
     # Ordenar categorias: normais primeiro, opinião/comentário sempre por último
     opinion_cats = ["Artigos de opinião", "Comentários"]
     all_categories = df['Categoria_final'].dropna().unique().tolist()
@@ -652,7 +947,7 @@ def main(input_path, output_path):
     prs = Presentation()
 
     # 1. Slide de capa
-    add_cover_slide(prs, "Relatório de notícias semanal", ICON_PATH, IMAGE_PATH)
+    add_cover_slide(prs, "Relatório de notícias semanal", ICON_PATH, IMAGE_PATH, period)
 
     # 2. Overview
     pie_buf = create_pie_chart(df)
@@ -699,7 +994,112 @@ def main(input_path, output_path):
     # Números no canto inferior
     add_slide_numbers(prs)
 
-    prs.save(output_path)
+    prs.save(output)
+
+
+def main(input_path, output_path, max_rows=None):
+    df = load_report_data(input_path, max_rows)
+    build_report(df, output_path)
+
+
+# ===== Vários relatórios a partir de um único upload =====
+
+def data_period(df):
+    """Intervalo (início, fim) das datas de publicação de `df`, ou None."""
+    dates = pd.to_datetime(df['Data de publicação'], errors='coerce').dropna()
+    if dates.empty:
+        return None
+    return dates.min().date(), dates.max().date()
+
+
+def _slug(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^A-Za-z0-9]+', '_', text).strip('_') or "sem_nome"
+
+
+def partition_report_data(df, partition_column=None, window_days=None):
+    """Divide `df` por valor de `partition_column` e/ou janelas de `window_days` dias.
+
+    Devolve uma lista de (nome, índices das linhas).
+    """
+    if partition_column is not None and partition_column not in df.columns:
+        raise InvalidPartition(f"Coluna '{partition_column}' não existe no ficheiro.")
+
+    keys = []
+    if partition_column is not None:
+        keys.append(df[partition_column].fillna("sem valor").astype(str))
+    if window_days:
+        dates = pd.to_datetime(df['Data de publicação'], errors='coerce')
+        start = dates.min()
+        if pd.isna(start):
+            raise InvalidPartition("Sem datas de publicação para dividir por períodos.")
+        window = (dates - start).dt.days // window_days
+        window_start = start + pd.to_timedelta(window * window_days, unit='D')
+        window_end = window_start + pd.to_timedelta(window_days - 1, unit='D')
+        # Linhas sem data ficam de fora das janelas
+        keys.append(window_start.dt.strftime('%Y-%m-%d') + "_" + window_end.dt.strftime('%Y-%m-%d'))
+
+    names = keys[0] if len(keys) == 1 else keys[0] + "_" + keys[1]
+    names = names.dropna()
+    groups = sorted(names.groupby(names).groups.items())
+    if len(groups) > MAX_PARTITIONS:
+        raise InvalidPartition(
+            f"O ficheiro gera {len(groups)} partições (máximo permitido: {MAX_PARTITIONS}).")
+
+    # Nomes seguros para ficheiros, sem repetições
+    partitions, used = [], set()
+    for key, index in groups:
+        name = base = _slug(key)
+        n = 2
+        while name in used:
+            name, n = f"{base}_{n}", n + 1
+        used.add(name)
+        partitions.append((name, index.tolist()))
+    return partitions
+
+
+# DataFrame partilhado pelos processos do pool (herdado por fork ou passado uma vez por worker)
+_shared_df = None
+
+def _init_partition_worker(df):
+    global _shared_df
+    _shared_df = df
+    load_asset(ICON_PATH)
+    load_asset(IMAGE_PATH)
+
+def _render_partition(index):
+    part = _shared_df.loc[index]
+    buf = BytesIO()
+    build_report(part, buf, data_period(part))
+    return buf.getvalue()
+
+
+def main_multi(input_path, output_path, partition_column=None, window_days=None,
+               max_rows=None, max_workers=None):
+    """Gera um PPTX por partição a partir de uma única leitura do Excel, num zip."""
+    df = load_report_data(input_path, max_rows)
+    partitions = partition_report_data(df, partition_column, window_days)
+    if not partitions:
+        raise InvalidPartition("Nenhuma linha para gerar relatórios.")
+
+    workers = min(len(partitions), max_workers or PARTITION_WORKERS)
+    indices = [index for _, index in partitions]
+    if workers <= 1:
+        _init_partition_worker(df)
+        decks = map(_render_partition, indices)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_partition_worker,
+                                   initargs=(df,))
+        decks = pool.map(_render_partition, indices)
+
+    try:
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for (name, _), deck in zip(partitions, decks):
+                zf.writestr(f"relatorio_{name}.pptx", deck)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
 
 
 if __name__ == "__main__":
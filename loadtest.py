@@ -0,0 +1,342 @@
+"""Teste de carga local para o serviço FastAPI (`app:app`).
+
+Arranca o uvicorn com N workers, envia workbooks gerados de vários tamanhos
+para /generate-report (misturados com /ping) a vários níveis de concorrência
+e mostra throughput, latências p50/p95/p99, taxa de erros e a memória (RSS)
+de cada worker ao longo do tempo.
+
+Exemplo:
+    python loadtest.py --workers 2 --concurrency 1,4,16 --rows 50,500,5000
+
+A latência do /ping mostra quando o event loop começa a bloquear; o pico de
+RSS por worker mostra onde está o teto de memória.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MEIOS = ["Imprensa", "Online", "TV", "Rádio"]
+TEMAS = ["Política", "Economia", "Sociedade", "Cultura", "Artigo de Opinião", "Comentário"]
+
+
+# ===== Geração de workbooks =====
+
+def make_workbook(rows, seed=0):
+    """Cria um Excel em memória com as colunas que o `main` espera."""
+    rng = random.Random(seed)
+    hoje = date.today()
+    data = {
+        'Meio': [rng.choice(MEIOS) for _ in range(rows)],
+        'Data de publicação': [hoje - timedelta(days=rng.randint(0, 27)) for _ in range(rows)],
+        'Título': [f"Notícia de teste {i}" for i in range(rows)],
+        'Publicação': [f"Jornal {rng.randint(1, 20)}" for _ in range(rows)],
+        'Circulação': [rng.randint(1000, 200000) for _ in range(rows)],
+        'Tema Principal': [rng.choice(TEMAS) for _ in range(rows)],
+        'Tema Secundário': ["" for _ in range(rows)],
+        'Autor': [f"Autor {rng.randint(1, 50)}" for _ in range(rows)],
+        'Instituição': [f"Instituição {rng.randint(1, 10)}" for _ in range(rows)],
+        'AAV': [rng.randint(100, 50000) for _ in range(rows)],
+    }
+    buf = BytesIO()
+    pd.DataFrame(data).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def multipart_body(field, filename, content):
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+    return head + content + tail, f"multipart/form-data; boundary={boundary}"
+
+
+# ===== Servidor =====
+
+def start_server(host, port, workers, env=None):
+    cmd = [sys.executable, "-m", "uvicorn", "app:app",
+           "--host", host, "--port", str(port), "--workers", str(workers),
+           "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env={**os.environ, **(env or {})})
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn terminou com código {proc.returncode}")
+        try:
+            status, _ = request(host, port, "GET", "/ping", timeout=2)
+            if status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("uvicorn não respondeu ao /ping em 60s")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def request(host, port, method, path, body=None, content_type=None, timeout=300):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        headers = {"Content-Type": content_type} if content_type else {}
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+# ===== Memória dos workers (Linux, via /proc) =====
+
+def _children_map():
+    children = defaultdict(list)
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # O nome do processo pode ter espaços; os campos começam depois do ')'
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children[ppid].append(int(name))
+    return children
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _is_spawned_worker(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().replace(b"\0", b" ")
+    except OSError:
+        return False
+    return b"multiprocessing.spawn" in cmdline
+
+
+def sample_worker_rss(server_pid, workers):
+    """Devolve {pid_worker: (rss_worker_kb, rss_com_renders_kb)}.
+
+    Com um só worker o uvicorn serve a partir do próprio processo; com vários,
+    os workers são filhos criados por spawn (o resource_tracker fica de fora).
+    """
+    children = _children_map()
+
+    def tree(pid):
+        total = _rss_kb(pid)
+        for child in children.get(pid, []):
+            total += tree(child)
+        return total
+
+    if workers == 1:
+        pids = [server_pid]
+    else:
+        pids = [pid for pid in children.get(server_pid, []) if _is_spawned_worker(pid)]
+    return {pid: (_rss_kb(pid), tree(pid)) for pid in pids}
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, server_pid, workers, interval):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.workers = workers
+        self.interval = interval
+        self.samples = []  # (t, {pid: (rss, rss_tree)})
+        self._stop_event = threading.Event()
+        self.t0 = time.monotonic()
+
+    def run(self):
+        if not os.path.isdir("/proc"):
+            return
+        while not self._stop_event.is_set():
+            self.samples.append((time.monotonic() - self.t0, sample_worker_rss(self.server_pid, self.workers)))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def peak_between(self, start, end):
+        peaks = {}
+        for t, sample in self.samples:
+            if start <= t <= end:
+                for pid, (rss, rss_tree) in sample.items():
+                    old = peaks.get(pid, (0, 0))
+                    peaks[pid] = (max(old[0], rss), max(old[1], rss_tree))
+        return peaks
+
+
+# ===== Carga =====
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    # Nearest-rank
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def run_level(host, port, concurrency, total_requests, workbooks, ping_ratio, seed):
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(total_requests):
+        if rng.random() < ping_ratio:
+            plan.append(("ping", None))
+        else:
+            plan.append(("report", rng.choice(list(workbooks))))
+
+    def one(item):
+        kind, rows = item
+        start = time.perf_counter()
+        try:
+            if kind == "ping":
+                status, _ = request(host, port, "GET", "/ping")
+            else:
+                body, ctype = multipart_body("file", f"load_{rows}.xlsx", workbooks[rows])
+                status, _ = request(host, port, "POST", "/generate-report", body, ctype)
+        except OSError as e:
+            status = type(e).__name__
+        return kind, rows, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, plan))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    # Rejeições rápidas (429/413/504) e erros de ligação não contam como trabalho útil
+    ok_total = sum(1 for _, _, status, _ in results if status == 200)
+    summary = {
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "ok_throughput_rps": ok_total / elapsed if elapsed else 0.0,
+    }
+    groups = defaultdict(list)
+    for kind, rows, status, latency in results:
+        key = "ping" if kind == "ping" else f"report[{rows}]"
+        groups[key].append((status, latency))
+    endpoints = {}
+    for key in sorted(groups):
+        entries = groups[key]
+        ok = [lat for status, lat in entries if status == 200]
+        statuses = defaultdict(int)
+        for status, _ in entries:
+            statuses[str(status)] += 1
+        endpoints[key] = {
+            "requests": len(entries),
+            "error_rate": 1 - len(ok) / len(entries),
+            "p50_ms": percentile(ok, 50) * 1000,
+            "p95_ms": percentile(ok, 95) * 1000,
+            "p99_ms": percentile(ok, 99) * 1000,
+            "statuses": dict(statuses),
+        }
+    summary["endpoints"] = endpoints
+    return summary
+
+
+def print_level(concurrency, summary, peaks):
+    print(f"\n=== concorrência {concurrency}: {summary['ok_throughput_rps']:.2f} req/s com sucesso "
+          f"({summary['throughput_rps']:.2f} req/s no total) em {summary['elapsed_s']:.1f}s ===")
+    print(f"{'endpoint':<16}{'pedidos':>8}{'erros':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  estados")
+    for key, ep in summary["endpoints"].items():
+        print(f"{key:<16}{ep['requests']:>8}{ep['error_rate']:>8.1%}"
+              f"{ep['p50_ms']:>10.0f}{ep['p95_ms']:>10.0f}{ep['p99_ms']:>10.0f}  {ep['statuses']}")
+    for pid, (rss, rss_tree) in sorted(peaks.items()):
+        print(f"worker {pid}: pico RSS {rss / 1024:.0f} MiB (com renders: {rss_tree / 1024:.0f} MiB)")
+
+
+def parse_int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga local para o serviço de relatórios.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="workers do uvicorn")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 16],
+                        help="níveis de concorrência, separados por vírgulas")
+    parser.add_argument("--requests", type=int, default=40, help="pedidos por nível")
+    parser.add_argument("--rows", type=parse_int_list, default=[50, 500, 2000],
+                        help="tamanhos (linhas) dos workbooks gerados")
+    parser.add_argument("--ping-ratio", type=float, default=0.3,
+                        help="fração dos pedidos que vão para /ping")
+    parser.add_argument("--rss-interval", type=float, default=0.5, help="segundos entre amostras de RSS")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="guardar resultados (e série de RSS) em JSON")
+    args = parser.parse_args()
+
+    workbooks = {rows: make_workbook(rows, seed=args.seed + rows) for rows in args.rows}
+    for rows, content in workbooks.items():
+        print(f"workbook {rows} linhas: {len(content) / 1024:.0f} KiB")
+
+    server = start_server(args.host, args.port, args.workers)
+    sampler = RssSampler(server.pid, args.workers, args.rss_interval)
+    sampler.start()
+    levels = []
+    try:
+        for i, concurrency in enumerate(args.concurrency):
+            t_start = time.monotonic() - sampler.t0
+            results, elapsed = run_level(args.host, args.port, concurrency, args.requests,
+                                         workbooks, args.ping_ratio, args.seed + i)
+            t_end = time.monotonic() - sampler.t0
+            summary = summarize(results, elapsed)
+            peaks = sampler.peak_between(t_start, t_end)
+            print_level(concurrency, summary, peaks)
+            levels.append({"concurrency": concurrency, "t_start": t_start, "t_end": t_end,
+                           "peak_rss_kb": {str(pid): list(v) for pid, v in peaks.items()},
+                           **summary})
+    finally:
+        sampler.stop()
+        stop_server(server)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "workers": args.workers,
+                "levels": levels,
+                "rss_timeline": [{"t": t, "rss_kb": {str(pid): list(v) for pid, v in sample.items()}}
+                                 for t, sample in sampler.samples],
+            }, f, indent=2)
+        print(f"\nResultados guardados em {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()